@@ -1,9 +1,36 @@
+"""
+Migration des réservations de chambres de PostgreSQL vers MongoDB.
+
+Toute écriture vers PostgreSQL (audit, marqueurs de déduplication...) doit
+passer par bulk_upsert() / psycopg2.extras.execute_values (ou
+execute_batch), jamais par cursor.executemany(), qui envoie une requête
+par ligne.
+
+Journalisation : toujours passer les valeurs en arguments du logger
+(logger.info("%d documents", n)) plutôt qu'en f-string, afin que le
+message ne soit formaté que si le niveau est actif, notamment dans les
+boucles exécutées par lot.
+
+Prérequis PostgreSQL : les index de PG_INDEXES doivent exister pour que
+les jointures et agrégats de l'extraction passent par des recherches
+d'index. Ils peuvent être créés avec ENSURE_PG_INDEXES=1.
+"""
 import os
 import logging
-from datetime import datetime, date
+import threading
+import json
+import queue
+import re
+from datetime import datetime, date, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import psycopg2
 from psycopg2 import sql
-from pymongo import MongoClient
+from psycopg2.extensions import encodings
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from pymongo import MongoClient, ReplaceOne, IndexModel
+from pymongo.write_concern import WriteConcern
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
 
 # Chargement des variables d'environnement depuis un fichier .env (si nécessaire)
@@ -15,7 +42,16 @@ from dotenv import load_dotenv
 # POSTGRES_PORT=5432
 # MONGO_URI=mongodb://localhost:27017/
 # MONGO_DBNAME=pfetest
-# MONGO_COLLECTION=reservation_rooms_data1
+# MONGO_COLLECTION=reservation_rooms_data1  (sinon la collection par défaut
+#   de la variante, voir DEFAULT_COLLECTIONS ; les deux variantes ne doivent
+#   pas partager une collection, leurs documents s'écraseraient)
+# QUERY_VARIANT=full  (ou "lite", ancienne requête de scriptrans.py)
+# NUM_SHARDS=1  (>1 pour extraire des plages de rr.id en parallèle)
+# EXTRACT_MODE=cursor  (ou "copy")
+# POSTGRES_SSLMODE=prefer
+# MONGO_COMPRESSORS=zstd,snappy,zlib
+# FULL_RELOAD=0  (1 pour supprimer les index MongoDB pendant le chargement)
+# ENSURE_PG_INDEXES=0  (1 pour créer les index de PG_INDEXES avant l'extraction)
 
 load_dotenv()
 
@@ -26,25 +62,279 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def get_postgres_connection():
+# Nombre de lignes rapatriées par aller-retour depuis le curseur serveur
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', 10000))
+# Nombre de documents envoyés par appel à bulk_write
+INSERT_BATCH_SIZE = int(os.getenv('INSERT_BATCH_SIZE', 1000))
+# FAST_INSERT=1 : écritures non acquittées (w=0) pour le chargement en masse.
+# Par défaut les écritures restent acquittées.
+FAST_INSERT = os.getenv('FAST_INSERT', '0') == '1'
+# FULL_RELOAD=1 : index secondaires MongoDB supprimés puis recréés autour du chargement
+FULL_RELOAD = os.getenv('FULL_RELOAD', '0') == '1'
+# Taille maximale du pool de connexions PostgreSQL
+PG_POOL_MAXCONN = int(os.getenv('PG_POOL_MAXCONN', 8))
+# Nombre de partitions (plages contiguës de rr.id) extraites en parallèle ;
+# 1 par défaut : une seule requête, comme sans parallélisme
+NUM_SHARDS = int(os.getenv('NUM_SHARDS', 1))
+# Mode d'extraction : 'cursor' (curseur serveur) ou 'copy' (COPY ... TO STDOUT,
+# lignes transmises en JSON : un éventuel numeric y deviendrait un float)
+EXTRACT_MODE = os.getenv('EXTRACT_MODE', 'cursor')
+# Nombre maximal de lots en attente entre extraction et insertion
+PIPELINE_DEPTH = int(os.getenv('PIPELINE_DEPTH', 4))
+
+# Pool de connexions PostgreSQL, créé à la première demande ; le verrou
+# garantit qu'un seul pool est créé quand plusieurs partitions démarrent.
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
+
+# Requête complète : annulations agrégées par client et par chambre
+# Les deux requêtes renvoient rr.id en _id : une ligne par chambre réservée,
+# ce qui rend les rechargements idempotents côté MongoDB.
+FULL_QUERY = sql.SQL("""
+    /* Agrégats calculés en une seule passe puis joints sur rr */
+    WITH cancel_counts AS (
+        SELECT r2.master_guest_id, COUNT(*) AS nb_cancelled
+        FROM magic_hotels_skanes.reservation_rooms r2
+        JOIN magic_hotels_skanes.reservation_states s2 ON s2.id = r2.reservation_state_id
+        WHERE s2.system_value = 'cancelled'
+        {guests_filter}
+        GROUP BY r2.master_guest_id
+    ),
+    cancel_dates AS (
+        SELECT rrs.reservation_room_id, MIN(rrs.created_at) AS cancelled_at
+        FROM magic_hotels_skanes.reservation_room_states rrs
+        JOIN magic_hotels_skanes.reservation_states st ON st.id = rrs.reservation_state_id
+        WHERE st.system_value = 'cancelled'
+        {states_filter}
+        GROUP BY rrs.reservation_room_id
+    )
+    SELECT
+        rr.id AS _id,
+        rr.reservation_id,
+        rr.room_type_id AS requested_room_type_id,
+        rrt.code AS requested_room_type_code,
+        art.code AS assigned_room_type_code,
+        /* Dates converties en timestamp : BSON n'a pas de type date seule */
+        rr.arrival::timestamp AS arrival_date,
+        rr.departure::timestamp AS departure_date,
+        rr.stay,
+        rr.booking_date::timestamp AS booking_date,
+        gc.country AS origin_city,
+        ro.name AS origin_reservation,
+        rs.name AS source_reservation,
+        rr.number_of_adult + rr.number_of_child + rr.inf AS occupancy,
+        rr.card_group_id,
+        agency.name AS card_group_name,
+        rr.card_group_type,
+        rr.market_code_id,
+        mc.name AS market_code_name,
+        rt.code AS rate_code,
+        rt.name AS rate_name,
+
+        /* Nombre de réservations annulées du client */
+        COALESCE(cc.nb_cancelled, 0) AS preview_cancelled,
+
+        false AS preview_no_show,
+
+        /* Première date d'annulation de la chambre */
+        cd.cancelled_at AS cancelled_date,
+
+        NULL AS no_show_date,
+        NULL AS preference_guest,
+        NULL AS preference_reservation,
+        NULL AS season
+
+    FROM magic_hotels_skanes.reservation_rooms rr
+    LEFT JOIN magic_hotels_skanes.room_types rrt ON rr.room_type_id = rrt.id
+    LEFT JOIN magic_hotels.guest_cards gc ON rr.master_guest_id = gc.id
+    LEFT JOIN magic_hotels_skanes.room_types art ON rr.assigned_room_type_id = art.id
+    LEFT JOIN magic_hotels_skanes.reservation_origins ro ON rr.reservation_origin_id = ro.id
+    LEFT JOIN magic_hotels_skanes.reservation_sources rs ON rr.reservation_source_id = rs.id
+    LEFT JOIN magic_hotels.market_codes mc ON rr.market_code_id = mc.id
+    /* Une seule nuitée (la première) par chambre pour éviter de dupliquer la ligne */
+    LEFT JOIN LATERAL (
+        SELECT n.rate_id
+        FROM magic_hotels_skanes.reservation_room_nights n
+        WHERE n.reservation_room_id = rr.id
+        ORDER BY n.night_date
+        LIMIT 1
+    ) rrn ON true
+    LEFT JOIN magic_hotels_skanes.rates rt ON rrn.rate_id = rt.id
+    LEFT JOIN magic_hotels.agency_cards agency ON rr.card_group_id = agency.id
+    LEFT JOIN cancel_counts cc ON cc.master_guest_id = rr.master_guest_id
+    LEFT JOIN cancel_dates cd ON cd.reservation_room_id = rr.id
+    {rooms_filter}
+""")
+
+# Variante allégée (ancien scriptrans.py) : pas d'agrégats sur les annulations,
+# la date d'annulation est lue directement sur la chambre.
+LITE_QUERY = sql.SQL("""
+    SELECT
+        rr.id AS _id,
+        rr.reservation_id,
+        rr.room_type_id AS requested_room_type_id,
+        rrt.code AS requested_room_type_code,
+        art.code AS assigned_room_type_code,
+        rr.arrival::timestamp AS arrival_date,
+        rr.departure::timestamp AS departure_date,
+        rr.stay,
+        rr.booking_date::timestamp AS booking_date,
+        gc.country AS origin_city,
+        ro.name AS origin_reservation,
+        rs.name AS source_reservation,
+        rr.number_of_adult + rr.number_of_child + rr.inf AS occupancy,
+        rr.card_group_id,
+        agency.name AS card_group_name,
+        rr.card_group_type,
+        rr.market_code_id,
+        mc.name AS market_code_name,
+        rt.code AS rate_code,
+        rt.name AS rate_name,
+        false AS preview_cancelled,
+        false AS preview_no_show,
+        rr.canceled_at AS cancelled_date,
+        NULL AS no_show_date,
+        NULL AS preference_guest,
+        NULL AS preference_reservation,
+        NULL AS season
+    FROM magic_hotels_skanes.reservation_rooms rr
+    LEFT JOIN magic_hotels_skanes.room_types rrt ON rr.room_type_id = rrt.id
+    LEFT JOIN magic_hotels_skanes.room_types art ON rr.assigned_room_type_id = art.id
+    LEFT JOIN magic_hotels_skanes.reservation_origins ro ON rr.reservation_origin_id = ro.id
+    LEFT JOIN magic_hotels_skanes.reservation_sources rs ON rr.reservation_source_id = rs.id
+    LEFT JOIN magic_hotels.market_codes mc ON rr.market_code_id = mc.id
+    LEFT JOIN LATERAL (
+        SELECT n.rate_id
+        FROM magic_hotels_skanes.reservation_room_nights n
+        WHERE n.reservation_room_id = rr.id
+        ORDER BY n.night_date
+        LIMIT 1
+    ) rrn ON true
+    LEFT JOIN magic_hotels_skanes.rates rt ON rrn.rate_id = rt.id
+    LEFT JOIN magic_hotels.agency_cards agency ON rr.card_group_id = agency.id
+    LEFT JOIN magic_hotels.guest_cards gc ON rr.master_guest_id = gc.id
+    {rooms_filter}
+""")
+
+# Filtres de partition [lo, hi) sur rr.id, insérés dans les requêtes à la
+# place de {rooms_filter}, {states_filter} et {guests_filter}. Les agrégats
+# des CTE sont restreints à la partition pour ne pas être recalculés en
+# entier par chaque partition.
+SHARD_FILTERS = {
+    'rooms_filter': sql.SQL("WHERE rr.id >= %(lo)s AND rr.id < %(hi)s"),
+    'states_filter': sql.SQL(
+        "AND rrs.reservation_room_id >= %(lo)s AND rrs.reservation_room_id < %(hi)s"
+    ),
+    'guests_filter': sql.SQL("""AND r2.master_guest_id IN (
+            SELECT p.master_guest_id
+            FROM magic_hotels_skanes.reservation_rooms p
+            WHERE p.id >= %(lo)s AND p.id < %(hi)s
+        )"""),
+}
+NO_SHARD_FILTERS = {name: sql.SQL('') for name in SHARD_FILTERS}
+
+SHARD_BOUNDS_QUERY = sql.SQL(
+    "SELECT MIN(id), MAX(id) FROM magic_hotels_skanes.reservation_rooms"
+)
+
+# Colonnes de date, stockées en datetime BSON dans MongoDB
+DATE_COLUMNS = ('arrival_date', 'departure_date', 'booking_date', 'cancelled_date')
+# Fraction de seconde et fuseau « +HH » tels qu'émis par PostgreSQL en JSON
+_PG_FRACTION = re.compile(r'\.(\d{1,6})')
+_PG_SHORT_OFFSET = re.compile(r'(T[^+-]*[+-]\d{2})$')
+
+# Index côté table enfant utilisés par les jointures de l'extraction ; les
+# autres jointures portent sur la clé primaire (id) des tables parentes.
+# CONCURRENTLY évite de bloquer les écritures de l'application.
+PG_INDEX_SCHEMA = 'magic_hotels_skanes'
+PG_INDEXES = {
+    'idx_rrs_reservation_room_id': """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rrs_reservation_room_id
+       ON magic_hotels_skanes.reservation_room_states (reservation_room_id, reservation_state_id)""",
+    'idx_rrn_reservation_room_id': """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rrn_reservation_room_id
+       ON magic_hotels_skanes.reservation_room_nights (reservation_room_id, night_date)""",
+    'idx_rr_master_guest_id': """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rr_master_guest_id
+       ON magic_hotels_skanes.reservation_rooms (master_guest_id)""",
+    'idx_rr_reservation_state_id': """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rr_reservation_state_id
+       ON magic_hotels_skanes.reservation_rooms (reservation_state_id)""",
+}
+
+# Index de PG_INDEXES laissés INVALID par un CREATE INDEX CONCURRENTLY
+# interrompu : IF NOT EXISTS les considère comme existants.
+INVALID_INDEXES_QUERY = """
+    SELECT c.relname
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = %s
+    AND c.relname = ANY(%s)
+    AND NOT i.indisvalid
+"""
+
+# Requêtes d'extraction disponibles, sélectionnées via QUERY_VARIANT
+QUERIES = {
+    'full': FULL_QUERY,
+    'lite': LITE_QUERY,
+}
+
+# Collection MongoDB par défaut de chaque variante (MONGO_COLLECTION prime)
+DEFAULT_COLLECTIONS = {
+    'full': 'reservation_rooms_data1',
+    'lite': 'reservation_rooms_data5',
+}
+
+def get_postgres_pool():
     """
-    Établit et retourne une connexion à la base PostgreSQL
-    en utilisant les variables d'environnement.
+    Retourne le pool de connexions PostgreSQL partagé,
+    en le créant à partir des variables d'environnement si nécessaire.
+    """
+    global _pg_pool
+    with _pg_pool_lock:
+        if _pg_pool is None:
+            _pg_pool = ThreadedConnectionPool(
+                minconn=1,
+                maxconn=PG_POOL_MAXCONN,
+                host=os.getenv('POSTGRES_HOST', 'localhost'),
+                database=os.getenv('POSTGRES_DB', 'pfe'),
+                user=os.getenv('POSTGRES_USER', 'postgres'),
+                password=os.getenv('POSTGRES_PASSWORD', '123123'),
+                port=os.getenv('POSTGRES_PORT', 5432),
+                sslmode=os.getenv('POSTGRES_SSLMODE', 'prefer'),
+                options='-c client_encoding=UTF8'
+            )
+        return _pg_pool
+
+def get_postgres_connection(pool=None):
+    """
+    Emprunte et retourne une connexion PostgreSQL au pool (par défaut le
+    pool partagé). La connexion doit être rendue au même pool via
+    release_postgres_connection().
     """
     try:
-        conn = psycopg2.connect(
-            host=os.getenv('POSTGRES_HOST', 'localhost'),
-            database=os.getenv('POSTGRES_DB', 'pfe'),
-            user=os.getenv('POSTGRES_USER', 'postgres'),
-            password=os.getenv('POSTGRES_PASSWORD', '123123'),
-            port=os.getenv('POSTGRES_PORT', 5432)
-        )
+        conn = (pool or get_postgres_pool()).getconn()
         logger.info("Connexion à PostgreSQL établie avec succès.")
         return conn
     except psycopg2.Error as e:
-        logger.error(f"Erreur de connexion à PostgreSQL: {e}")
+        logger.error("Erreur de connexion à PostgreSQL: %s", e)
         raise
 
+def release_postgres_connection(conn, pool=None):
+    """
+    Rend une connexion au pool PostgreSQL dont elle provient (une
+    transaction en cours est annulée par le pool).
+    """
+    (pool or get_postgres_pool()).putconn(conn)
+
+def close_postgres_pool():
+    """
+    Ferme toutes les connexions du pool PostgreSQL.
+    """
+    global _pg_pool
+    with _pg_pool_lock:
+        if _pg_pool is not None:
+            _pg_pool.closeall()
+            _pg_pool = None
+            logger.info("Pool de connexions PostgreSQL fermé.")
+
 def get_mongo_client():
     """
     Établit et retourne un client MongoDB
@@ -52,152 +342,485 @@ def get_mongo_client():
     """
     try:
         mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
-        client = MongoClient(mongo_uri)
+        # Compression du protocole : le serveur retient le premier
+        # algorithme qu'il supporte, zstd/snappy sont ignorés si leur
+        # module Python n'est pas installé.
+        client = MongoClient(
+            mongo_uri,
+            maxPoolSize=50,
+            compressors=os.getenv('MONGO_COMPRESSORS', 'zstd,snappy,zlib'),
+            zlibCompressionLevel=3
+        )
         logger.info("Connexion à MongoDB établie avec succès.")
         return client
     except Exception as e:
-        logger.error(f"Erreur de connexion à MongoDB: {e}")
+        logger.error("Erreur de connexion à MongoDB: %s", e)
+        raise
+
+def extract_data_from_postgres(conn, variant='full', shard=0, id_range=None):
+    """
+    Extrait les données depuis PostgreSQL à l'aide de la requête
+    correspondant à `variant` ('full' ou 'lite').
+    Produit les données par lots : chaque itération renvoie une liste
+    d'au plus BATCH_SIZE dictionnaires, sans jamais charger tout le
+    résultat en mémoire. Selon EXTRACT_MODE, les lignes sont lues via un
+    curseur nommé (côté serveur) ou via COPY ... TO STDOUT.
+    Si id_range = (lo, hi) est fourni, seules les chambres telles que
+    lo <= rr.id < hi sont extraites.
+    """
+    if variant not in QUERIES:
+        raise ValueError(f"Variante de requête inconnue: {variant}")
+    if id_range is None:
+        query = QUERIES[variant].format(**NO_SHARD_FILTERS)
+        params = None
+    else:
+        query = QUERIES[variant].format(**SHARD_FILTERS)
+        params = {'lo': id_range[0], 'hi': id_range[1]}
+
+    if EXTRACT_MODE == 'copy':
+        batches = _fetch_with_copy(conn, query, params)
+    elif EXTRACT_MODE == 'cursor':
+        batches = _fetch_with_cursor(conn, query, params, shard)
+    else:
+        raise ValueError(f"Mode d'extraction inconnu: {EXTRACT_MODE}")
+
+    total = 0
+    try:
+        for batch in batches:
+            total += len(batch)
+            yield batch
+        logger.info("%d enregistrements extraits de PostgreSQL (partition %d).", total, shard)
+    except psycopg2.Error as e:
+        logger.error("Erreur lors de l'extraction des données: %s", e)
+        raise
+
+def compute_shard_ranges(conn, num_shards):
+    """
+    Découpe l'intervalle des rr.id en num_shards plages [lo, hi)
+    contiguës, exploitables par l'index de clé primaire. Retourne
+    [None] (pas de partitionnement) si num_shards <= 1 ou si la table
+    est vide.
+    """
+    if num_shards <= 1:
+        return [None]
+    with conn.cursor() as cursor:
+        cursor.execute(SHARD_BOUNDS_QUERY)
+        min_id, max_id = cursor.fetchone()
+    if min_id is None:
+        return [None]
+    step = -(-(max_id - min_id + 1) // num_shards)
+    return [
+        (lo, min(lo + step, max_id + 1))
+        for lo in range(min_id, max_id + 1, step)
+    ]
+
+def _invalid_postgres_indexes(cursor):
+    """
+    Retourne les noms des index de PG_INDEXES marqués INVALID.
+    """
+    cursor.execute(INVALID_INDEXES_QUERY, (PG_INDEX_SCHEMA, list(PG_INDEXES)))
+    return [row[0] for row in cursor.fetchall()]
+
+def ensure_postgres_indexes(conn):
+    """
+    Crée les index de PG_INDEXES s'ils n'existent pas encore, puis
+    reconstruit une fois ceux restés INVALID après un échec précédent.
+    CREATE INDEX CONCURRENTLY ne pouvant pas s'exécuter dans une
+    transaction, la connexion passe temporairement en autocommit.
+    """
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            for statement in PG_INDEXES.values():
+                cursor.execute(statement)
+            invalid = _invalid_postgres_indexes(cursor)
+            for name in invalid:
+                logger.warning("Index PostgreSQL %s invalide, reconstruction.", name)
+                cursor.execute(
+                    sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(
+                        sql.Identifier(PG_INDEX_SCHEMA, name)
+                    )
+                )
+                cursor.execute(PG_INDEXES[name])
+            if invalid:
+                invalid = _invalid_postgres_indexes(cursor)
+        if invalid:
+            logger.warning("Index PostgreSQL toujours invalides: %s", ', '.join(invalid))
+        else:
+            logger.info("Index PostgreSQL vérifiés.")
+    except psycopg2.Error as e:
+        logger.error("Erreur lors de la création des index PostgreSQL: %s", e)
         raise
+    finally:
+        conn.autocommit = autocommit
 
-def extract_data_from_postgres(conn):
-    """
-    Extrait les données depuis PostgreSQL à l'aide d'une requête SQL.
-    Retourne une liste de dictionnaires.
-    """
-    query = sql.SQL("""
-        SELECT
-            rr.reservation_id,
-            rr.room_type_id AS requested_room_type_id,
-            rrt.code AS requested_room_type_code,
-            art.code AS assigned_room_type_code,
-            rr.arrival AS arrival_date,
-            rr.departure AS departure_date,
-            rr.stay,
-            rr.booking_date,
-            gc.country AS origin_city,
-            ro.name AS origin_reservation,
-            rs.name AS source_reservation,
-            rr.number_of_adult + rr.number_of_child + rr.inf AS occupancy,
-            rr.card_group_id,
-            agency.name AS card_group_name,
-            rr.card_group_type,
-            rr.market_code_id,
-            mc.name AS market_code_name,
-            rt.code AS rate_code,
-            rt.name AS rate_name,
-
-            /* Sous-requête pour le nombre de réservations annulées */
-            (
-                SELECT COUNT(*)
-                FROM magic_hotels_skanes.reservation_rooms r2
-                JOIN magic_hotels_skanes.reservation_states s2 ON s2.id = r2.reservation_state_id
-                WHERE r2.master_guest_id = rr.master_guest_id
-                AND s2.system_value = 'cancelled'
-            ) AS preview_cancelled,
-
-            false AS preview_no_show,
-
-            (
-                SELECT rrs.created_at
-                FROM magic_hotels_skanes.reservation_room_states rrs
-                JOIN magic_hotels_skanes.reservation_states st ON st.id = rrs.reservation_state_id
-                WHERE rrs.reservation_room_id = rr.id
-                AND st.system_value = 'cancelled'
-                ORDER BY rrs.created_at ASC
-                LIMIT 1
-            ) AS cancelled_date,
-
-            NULL AS no_show_date,
-            NULL AS preference_guest,
-            NULL AS preference_reservation,
-            NULL AS season
-
-        FROM magic_hotels_skanes.reservation_rooms rr
-        LEFT JOIN magic_hotels_skanes.room_types rrt ON rr.room_type_id = rrt.id
-        LEFT JOIN magic_hotels.guest_cards gc ON rr.master_guest_id = gc.id
-        LEFT JOIN magic_hotels_skanes.room_types art ON rr.assigned_room_type_id = art.id
-        LEFT JOIN magic_hotels_skanes.reservation_origins ro ON rr.reservation_origin_id = ro.id
-        LEFT JOIN magic_hotels_skanes.reservation_sources rs ON rr.reservation_source_id = rs.id
-        LEFT JOIN magic_hotels.market_codes mc ON rr.market_code_id = mc.id
-        LEFT JOIN magic_hotels_skanes.reservation_room_nights rrn ON rrn.reservation_room_id = rr.id
-        LEFT JOIN magic_hotels_skanes.rates rt ON rrn.rate_id = rt.id
-        LEFT JOIN magic_hotels.agency_cards agency ON rr.card_group_id = agency.id
-     
-
-    """)
-
-    data = []
+def bulk_upsert(conn, sql_template, rows, page_size=1000):
+    """
+    Écrit un ensemble de lignes dans PostgreSQL avec execute_values :
+    sql_template doit contenir un unique « VALUES %s », étendu en
+    requêtes multi-lignes de page_size lignes. La transaction est laissée
+    à la charge de l'appelant.
+    """
     try:
         with conn.cursor() as cursor:
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            colnames = [desc[0] for desc in cursor.description]
-            for row in rows:
-                record = dict(zip(colnames, row))
-                data.append(record)
-        logger.info(f"{len(data)} enregistrements extraits de PostgreSQL.")
+            execute_values(cursor, sql_template, rows, page_size=page_size)
     except psycopg2.Error as e:
-        logger.error(f"Erreur lors de l'extraction des données: {e}")
+        logger.error("Erreur lors de l'écriture dans PostgreSQL: %s", e)
         raise
 
-    return data
+def _fetch_with_cursor(conn, query, params, shard):
+    """
+    Lit le résultat de la requête par lots via un curseur nommé.
+    """
+    # RealDictCursor construit directement chaque ligne en dictionnaire
+    with conn.cursor(name=f'rr_export_{shard}', cursor_factory=RealDictCursor) as cursor:
+        cursor.itersize = BATCH_SIZE
+        cursor.execute(query, params)
+        while True:
+            batch = cursor.fetchmany(BATCH_SIZE)
+            if not batch:
+                break
+            yield batch
+
+class _CopyCancelled(Exception):
+    """
+    Levée dans le thread COPY quand le lecteur des lots s'est arrêté.
+    """
+
+class _CopyBatchWriter:
+    """
+    Objet fichier minimal passé à copy_expert : découpe le flux reçu en
+    lignes JSON et dépose dans une file des lots de BATCH_SIZE documents
+    au fur et à mesure de leur arrivée.
+    """
+    def __init__(self, batches, stop):
+        self._batches = batches
+        self._stop = stop
+        self._tail = b''
+        self._batch = []
+
+    def write(self, data):
+        lines = (self._tail + data).split(b'\n')
+        # Dernière ligne éventuellement incomplète, complétée au prochain appel
+        self._tail = lines.pop()
+        for line in lines:
+            self._batch.append(json.loads(line))
+            if len(self._batch) >= BATCH_SIZE:
+                self.put(self._batch)
+                self._batch = []
+
+    def flush_remaining(self):
+        if self._tail:
+            self._batch.append(json.loads(self._tail))
+            self._tail = b''
+        if self._batch:
+            self.put(self._batch)
+            self._batch = []
+
+    def put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._batches.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise _CopyCancelled()
+
+def _fetch_with_copy(conn, query, params):
+    """
+    Lit le résultat de la requête par lots via COPY ... TO STDOUT.
+    Chaque ligne est émise en JSON par PostgreSQL (row_to_json). Les
+    caractères de quote et de délimiteur du format CSV sont choisis pour
+    ne jamais apparaître, le JSON est donc recopié tel quel, une ligne
+    par rangée. COPY tourne dans un thread dédié et les lots sont
+    produits en continu, sans attendre la fin de l'export ; si le lecteur
+    s'arrête avant la fin, la requête est annulée côté serveur.
+    Le JSON conserve les entiers, booléens et NULL, mais une colonne
+    numeric deviendrait un float (le curseur renvoie un Decimal) : les
+    requêtes actuelles n'en contiennent pas.
+    """
+    with conn.cursor() as cursor:
+        select = cursor.mogrify(query, params).decode(encodings[conn.encoding])
+        copy_sql = (
+            f"COPY (SELECT row_to_json(q) FROM ({select}) q) TO STDOUT "
+            "WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+        )
+        batches = queue.Queue(maxsize=PIPELINE_DEPTH)
+        stop = threading.Event()
+        completed = threading.Event()
+        errors = []
+        writer = _CopyBatchWriter(batches, stop)
+
+        def run_copy():
+            try:
+                cursor.copy_expert(copy_sql, writer)
+                completed.set()
+                writer.flush_remaining()
+            except _CopyCancelled:
+                pass
+            except Exception as e:
+                errors.append(e)
+            finally:
+                try:
+                    # Sentinelle : fin de l'export
+                    writer.put(None)
+                except _CopyCancelled:
+                    pass
+
+        copier = threading.Thread(target=run_copy, name='copy-export')
+        copier.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            stop.set()
+            if not completed.is_set():
+                # Sans annulation, libpq lirait tout le reste de l'export
+                # avant de pouvoir rendre la connexion au pool
+                conn.cancel()
+            copier.join()
+        if errors:
+            raise errors[0]
+
+def _parse_pg_timestamp(value):
+    """
+    Convertit un timestamp PostgreSQL sérialisé en JSON en datetime.
+    La fraction de seconde est complétée à 6 chiffres et le fuseau
+    « +HH » réécrit en « +HH:00 », formats refusés par fromisoformat
+    avant Python 3.11.
+    """
+    value = _PG_FRACTION.sub(lambda m: '.' + m.group(1).ljust(6, '0'), value)
+    value = _PG_SHORT_OFFSET.sub(r'\1:00', value)
+    return datetime.fromisoformat(value)
 
 def transform_data(records):
     """
     Transforme les données avant l'insertion dans MongoDB.
-    Par exemple, conversion des dates en chaînes de caractères ISO 8601.
+    Les datetime sont encodés nativement par BSON ; seules les colonnes de
+    DATE_COLUMNS reçues en chaîne ISO 8601 (mode COPY) ou en date seule
+    sont converties en datetime.
     """
     for record in records:
-        for key, value in record.items():
-            if isinstance(value, (datetime, date)):
-                record[key] = value.isoformat()
+        for key in DATE_COLUMNS:
+            value = record.get(key)
+            if isinstance(value, str):
+                record[key] = _parse_pg_timestamp(value)
+            elif isinstance(value, date) and not isinstance(value, datetime):
+                record[key] = datetime.combine(value, time.min)
     return records
 
-def load_data_to_mongo(client, records):
+def get_mongo_collection(client, variant='full'):
     """
-    Insère les données dans la collection MongoDB spécifiée.
+    Retourne la collection MongoDB cible définie par les variables
+    d'environnement (par défaut celle de la variante).
     """
     db_name = os.getenv('MONGO_DBNAME', 'pfetest')
-    collection_name = os.getenv('MONGO_COLLECTION', 'reservation_rooms_data1')
+    collection_name = os.getenv('MONGO_COLLECTION', DEFAULT_COLLECTIONS[variant])
+    return client[db_name][collection_name]
 
-    db = client[db_name]
-    collection = db[collection_name]
+def drop_mongo_indexes(collection):
+    """
+    Supprime les index secondaires de la collection (l'index _id est
+    conservé) et retourne leur définition pour les recréer ensuite.
+    """
+    indexes = []
+    for name, info in collection.index_information().items():
+        if name == '_id_':
+            continue
+        options = {k: v for k, v in info.items() if k not in ('key', 'v', 'ns')}
+        indexes.append(IndexModel(info['key'], name=name, **options))
+    if indexes:
+        # Trace des définitions pour pouvoir recréer les index à la main si
+        # le processus est interrompu avant restore_mongo_indexes()
+        for index in indexes:
+            logger.warning(
+                "Suppression de l'index MongoDB %s.%s : %s",
+                collection.full_name, index.document['name'], index.document
+            )
+        collection.drop_indexes()
+        logger.info("%d index MongoDB supprimés avant le chargement.", len(indexes))
+    return indexes
+
+def restore_mongo_indexes(collection, indexes):
+    """
+    Recrée les index supprimés par drop_mongo_indexes(). En cas d'échec
+    (par exemple un index unique violé par le rechargement), chaque index
+    absent de la collection est journalisé avant de relancer l'erreur.
+    """
+    if not indexes:
+        return
+    try:
+        collection.create_indexes(indexes)
+    except Exception as e:
+        try:
+            existing = collection.index_information()
+        except Exception:
+            # Collection inaccessible : aucun index n'est considéré recréé
+            existing = {}
+        for index in indexes:
+            if index.document['name'] not in existing:
+                logger.error(
+                    "Index MongoDB %s.%s non recréé : %s",
+                    collection.full_name, index.document['name'], index.document
+                )
+        logger.error("Erreur lors de la recréation des index MongoDB: %s", e)
+        raise
+    logger.info("%d index MongoDB recréés.", len(indexes))
+
+def load_data_to_mongo(client, records, variant='full'):
+    """
+    Écrit les données dans la collection MongoDB spécifiée (par défaut
+    celle de la variante), par lots de INSERT_BATCH_SIZE documents en
+    mode non ordonné. Chaque document remplace celui de même _id
+    (upsert), un rechargement ne crée donc pas de doublons.
+    """
+    collection = get_mongo_collection(client, variant)
+    if FAST_INSERT:
+        # Pas d'attente d'acquittement du serveur entre deux lots
+        collection = collection.with_options(write_concern=WriteConcern(w=0))
+        write_options = {}
+    else:
+        # Non autorisé par PyMongo avec des écritures non acquittées
+        write_options = {'bypass_document_validation': True}
 
     if not records:
         logger.info("Aucun document à insérer dans MongoDB.")
         return
 
+    written = 0
+    for i in range(0, len(records), INSERT_BATCH_SIZE):
+        chunk = records[i:i + INSERT_BATCH_SIZE]
+        requests = [ReplaceOne({'_id': r['_id']}, r, upsert=True) for r in chunk]
+        try:
+            result = collection.bulk_write(
+                requests,
+                ordered=False,
+                **write_options
+            )
+            if result.acknowledged:
+                written += result.upserted_count + result.matched_count
+            else:
+                written += len(requests)
+        except BulkWriteError as e:
+            # Écriture non ordonnée : les documents valides du lot sont
+            # tout de même écrits, on journalise les rejets et on continue.
+            written += e.details.get('nUpserted', 0) + e.details.get('nMatched', 0)
+            logger.warning(
+                "%d documents rejetés par MongoDB dans le lot %d.",
+                len(e.details.get('writeErrors', [])), i // INSERT_BATCH_SIZE
+            )
+        except Exception as e:
+            logger.error("Erreur lors de l'insertion dans MongoDB: %s", e)
+            raise
+    if FAST_INSERT:
+        logger.info("%d documents envoyés à MongoDB (w=0, non acquittés).", written)
+    else:
+        logger.info("%d documents insérés ou remplacés dans MongoDB.", written)
+
+def migrate_shard(mongo_client, variant, shard, id_range):
+    """
+    Migre une partition des données avec sa propre connexion du pool.
+    L'extraction tourne dans un thread producteur qui dépose les lots dans
+    une file bornée ; le thread courant les transforme et les insère, de
+    sorte que PostgreSQL et MongoDB travaillent en parallèle.
+    """
+    pool = get_postgres_pool()
+    pg_conn = get_postgres_connection(pool)
+    batches = queue.Queue(maxsize=PIPELINE_DEPTH)
+    stop = threading.Event()
+    errors = []
+
+    def produce():
+        try:
+            for batch in extract_data_from_postgres(pg_conn, variant, shard, id_range):
+                if stop.is_set():
+                    break
+                batches.put(batch)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # Sentinelle : fin de l'extraction
+            batches.put(None)
+
+    producer = threading.Thread(target=produce, name=f'extract-{shard}')
+    producer.start()
     try:
-        result = collection.insert_many(records)
-        logger.info(f"{len(result.inserted_ids)} documents insérés dans MongoDB.")
-    except Exception as e:
-        logger.error(f"Erreur lors de l'insertion dans MongoDB: {e}")
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            batch = transform_data(batch)
+            load_data_to_mongo(mongo_client, batch, variant)
+    except Exception:
+        # Arrête le producteur et vide la file pour le débloquer
+        stop.set()
+        while batches.get() is not None:
+            pass
         raise
+    finally:
+        producer.join()
+        release_postgres_connection(pg_conn, pool)
+        logger.info("Connexion PostgreSQL rendue au pool (partition %d).", shard)
+
+    if errors:
+        raise errors[0]
 
-def main():
-    pg_conn = None
+def main(variant=None):
+    variant = variant or os.getenv('QUERY_VARIANT', 'full')
     mongo_client = None
 
     try:
-        pg_conn = get_postgres_connection()
-        data = extract_data_from_postgres(pg_conn)
+        # Pool créé ici, avant le démarrage des threads de partition
+        get_postgres_pool()
 
-        # Transformations éventuelles
-        data = transform_data(data)
+        pg_conn = get_postgres_connection()
+        try:
+            if os.getenv('ENSURE_PG_INDEXES', '0') == '1':
+                ensure_postgres_indexes(pg_conn)
+            id_ranges = compute_shard_ranges(pg_conn, NUM_SHARDS)
+        finally:
+            release_postgres_connection(pg_conn)
 
         mongo_client = get_mongo_client()
-        load_data_to_mongo(mongo_client, data)
+
+        # Rechargement complet : un seul tri par index à la fin plutôt
+        # qu'une mise à jour des index à chaque document
+        collection = get_mongo_collection(mongo_client, variant)
+        indexes = drop_mongo_indexes(collection) if FULL_RELOAD else []
+
+        try:
+            # Au plus PG_POOL_MAXCONN partitions traitées simultanément
+            workers = max(1, min(len(id_ranges), PG_POOL_MAXCONN))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(migrate_shard, mongo_client, variant, shard, id_range): shard
+                    for shard, id_range in enumerate(id_ranges)
+                }
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error(
+                            "Erreur lors de la migration de la partition %d: %s",
+                            futures[future], e
+                        )
+        finally:
+            restore_mongo_indexes(collection, indexes)
 
     except Exception as e:
-        logger.error(f"Erreur dans le script principal: {e}")
+        logger.error("Erreur dans le script principal: %s", e)
     finally:
         # Fermeture des connexions
-        if pg_conn:
-            pg_conn.close()
-            logger.info("Connexion à PostgreSQL fermée.")
         if mongo_client:
             mongo_client.close()
             logger.info("Connexion à MongoDB fermée.")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        close_postgres_pool()